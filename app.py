@@ -1,10 +1,24 @@
-from flask import Flask, jsonify, request, render_template, send_from_directory
+from flask import Flask, Response, jsonify, request, render_template, send_from_directory
 from flask_cors import CORS
 import sqlite3
 import os
 import time
+import queue
+import re
+import zlib
+import tempfile
 import threading
-from datetime import datetime
+import atexit
+import logging
+import logging.handlers
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:  # fall back to the stdlib encoder
+    import json
+    def _dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
 
 # ------------------ App setup ------------------
 app = Flask(__name__, instance_relative_config=True)
@@ -12,66 +26,553 @@ CORS(app)
 
 DB_PATH = os.path.join(app.instance_path, 'animal_feeder.db')
 
+# ------------------ Logging ------------------
+# Handlers only enqueue records; a listener thread does the stream I/O
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_q = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_q))
+
+def _start_log_listener():
+    global _log_listener
+    _log_listener = logging.handlers.QueueListener(_log_q, logging.StreamHandler())
+    _log_listener.start()
+
+_start_log_listener()
+os.register_at_fork(after_in_child=_start_log_listener)
+atexit.register(lambda: _log_listener.stop())
+
+# ------------------ JSON helper ------------------
+def ojson(obj, status=200):
+    """JSON response encoded with orjson when it is installed"""
+    return Response(_dumps(obj), status=status, mimetype='application/json')
+
+# ------------------ Pagination ------------------
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def page_args(default_limit=DEFAULT_PAGE_SIZE):
+    """Read ?limit=&offset= from the query string, clamped to sane bounds
+
+    A default_limit of None leaves the page unbounded unless ?limit= is given.
+    """
+    limit = request.args.get('limit', default_limit, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if limit is not None:
+        limit = min(max(limit, 0), MAX_PAGE_SIZE)
+    return limit, max(offset, 0)
+
 # ------------------ Database helper ------------------
-def query_db(query, args=(), one=False):
-    con = None
+READ_POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
+
+_read_pool = queue.Queue(maxsize=READ_POOL_SIZE)
+_write_conn = None
+_write_lock = threading.RLock()
+
+def _connect(read_only=False):
+    """Open a long-lived connection tuned for WAL mode"""
+    con = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False,
+                          isolation_level=None,
+                          cached_statements=STATEMENT_CACHE_SIZE)
+    con.row_factory = sqlite3.Row
+    if read_only:
+        con.execute("PRAGMA query_only=true")
+    else:
+        con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA cache_size=-20000")
+    con.execute("PRAGMA temp_store=MEMORY")
+    return con
+
+def _init_pool():
+    global _read_pool, _write_conn, _write_lock
+    # Fresh pool and lock so a forked worker never reuses its parent's handles
+    _read_pool = queue.Queue(maxsize=READ_POOL_SIZE)
+    _write_lock = threading.RLock()
+    # Writer first so the database is switched to WAL before readers attach
+    _write_conn = _connect()
+    for _ in range(READ_POOL_SIZE):
+        _read_pool.put(_connect(read_only=True))
+
+def query_db(query, args=(), one=False, write=False):
+    if write:
+        with _write_lock:
+            rv = _write_conn.execute(query, args).fetchall()
+    else:
+        con = _read_pool.get()
+        try:
+            rv = con.execute(query, args).fetchall()
+        finally:
+            _read_pool.put(con)
+    return (rv[0] if rv else None) if one else rv
+
+def query_db_rows(query, args=()):
+    """Run a read and return (column names, plain tuples) without sqlite3.Row"""
+    con = _read_pool.get()
     try:
-        con = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
-        con.row_factory = sqlite3.Row
         cur = con.cursor()
+        cur.row_factory = None
         cur.execute(query, args)
-        rv = cur.fetchall()
-        con.commit()
-        return (rv[0] if rv else None) if one else rv
-    except sqlite3.OperationalError as e:
-        if con:
-            con.rollback()
-        raise e
+        return [d[0] for d in cur.description], cur.fetchall()
     finally:
-        if con:
-            con.close()
+        _read_pool.put(con)
+
+def query_db_tx(statements):
+    """Run (query, args) pairs on the writer inside one transaction
+
+    Returns the number of rows each statement changed.
+    """
+    with _write_lock:
+        _write_conn.execute("BEGIN IMMEDIATE")
+        try:
+            counts = [_write_conn.execute(query, args).rowcount
+                      for query, args in statements]
+            _write_conn.execute("COMMIT")
+        except Exception:
+            _write_conn.execute("ROLLBACK")
+            raise
+    return counts
 
 os.makedirs(app.instance_path, exist_ok=True)
 
 # ------------------ Table creation ------------------
-query_db("""
+DDL = """
+BEGIN IMMEDIATE;
+
 CREATE TABLE IF NOT EXISTS camera (
     cam_id TEXT PRIMARY KEY,
     status TEXT NOT NULL
-)
-""")
+);
 
-query_db("""
 CREATE TABLE IF NOT EXISTS modules (
     module_id TEXT PRIMARY KEY,
     cam_id TEXT NOT NULL,
     status TEXT NOT NULL,
     weight REAL,
     FOREIGN KEY (cam_id) REFERENCES camera(cam_id)
-)
-""")
+);
 
-query_db("""
 CREATE TABLE IF NOT EXISTS schedules (
     schedule_id INTEGER PRIMARY KEY AUTOINCREMENT,
     module_id TEXT NOT NULL,
-    feed_time TEXT NOT NULL,
+    feed_time INTEGER NOT NULL,
     amount REAL NOT NULL,
     status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'done')),
     FOREIGN KEY (module_id) REFERENCES modules(module_id)
-)
-""")
+);
 
-query_db("""
 CREATE TABLE IF NOT EXISTS history (
     history_id INTEGER PRIMARY KEY AUTOINCREMENT,
     schedule_id INTEGER,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (schedule_id) REFERENCES schedules(schedule_id)
-)
-""")
+);
+
+-- Covers the /check_schedule predicate and its ORDER BY feed_time
+CREATE INDEX IF NOT EXISTS idx_sched_lookup
+ON schedules(module_id, status, feed_time);
 
+CREATE INDEX IF NOT EXISTS idx_hist_sched ON history(schedule_id);
 
+CREATE INDEX IF NOT EXISTS idx_mod_status ON modules(module_id, status);
+
+-- History joined with its schedule, maintained by triggers so /history
+-- reads a single table instead of running the join on every request
+CREATE TABLE IF NOT EXISTS history_denorm (
+    history_id INTEGER PRIMARY KEY,
+    created_at DATETIME,
+    schedule_id INTEGER,
+    module_id TEXT,
+    feed_time INTEGER,
+    amount REAL,
+    status TEXT
+);
+
+-- Scanned backwards for ORDER BY created_at DESC, history_id DESC
+CREATE INDEX IF NOT EXISTS idx_hdenorm_created ON history_denorm(created_at, history_id);
+
+-- One-off backfill for databases created before history_denorm existed
+INSERT INTO history_denorm (history_id, created_at, schedule_id, module_id, feed_time, amount, status)
+SELECT h.history_id, h.created_at, h.schedule_id, s.module_id, s.feed_time, s.amount, s.status
+FROM history h
+LEFT JOIN schedules s ON h.schedule_id = s.schedule_id
+WHERE NOT EXISTS (SELECT 1 FROM history_denorm);
+
+CREATE TRIGGER IF NOT EXISTS trg_hist_denorm_insert AFTER INSERT ON history
+BEGIN
+    INSERT INTO history_denorm (history_id, created_at, schedule_id, module_id, feed_time, amount, status)
+    SELECT NEW.history_id, NEW.created_at, NEW.schedule_id, s.module_id, s.feed_time, s.amount, s.status
+    FROM (SELECT 1)
+    LEFT JOIN schedules s ON s.schedule_id = NEW.schedule_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_hist_denorm_delete AFTER DELETE ON history
+BEGIN
+    DELETE FROM history_denorm WHERE history_id = OLD.history_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sched_denorm_update AFTER UPDATE ON schedules
+BEGIN
+    UPDATE history_denorm
+    SET module_id = NEW.module_id, feed_time = NEW.feed_time,
+        amount = NEW.amount, status = NEW.status
+    WHERE schedule_id = NEW.schedule_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sched_denorm_delete AFTER DELETE ON schedules
+BEGIN
+    UPDATE history_denorm
+    SET module_id = NULL, feed_time = NULL, amount = NULL, status = NULL
+    WHERE schedule_id = OLD.schedule_id;
+END;
+
+COMMIT;
+"""
+
+# ------------------ Migrations ------------------
+_MIGRATE_FEED_TIME = [
+    """
+    CREATE TABLE schedules_new (
+        schedule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        module_id TEXT NOT NULL,
+        feed_time INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'done')),
+        FOREIGN KEY (module_id) REFERENCES modules(module_id)
+    )
+    """,
+    """
+    INSERT INTO schedules_new (schedule_id, module_id, feed_time, amount, status)
+    SELECT schedule_id, module_id,
+           CAST(substr(feed_time, 1, instr(feed_time, ':') - 1) AS INTEGER) * 60
+         + CAST(substr(feed_time, instr(feed_time, ':') + 1) AS INTEGER),
+           amount, status
+    FROM schedules
+    """,
+    "DROP TABLE schedules",
+    "ALTER TABLE schedules_new RENAME TO schedules",
+]
+
+def _migrate_feed_time(con):
+    """Convert legacy TEXT "HH:MM" feed times to minutes since midnight"""
+    # Check inside the write lock so concurrent workers migrate at most once
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        cols = con.execute("PRAGMA table_info(schedules)").fetchall()
+        if cols and not any(c[1] == 'feed_time' and c[2] == 'INTEGER' for c in cols):
+            # The rebuild resets AUTOINCREMENT to MAX(schedule_id); keep the old
+            # counter so ids of deleted schedules still referenced by history
+            # are never handed out again
+            old_seq = con.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name='schedules'"
+            ).fetchone()
+            for stmt in _MIGRATE_FEED_TIME:
+                con.execute(stmt)
+            if old_seq:
+                cur = con.execute(
+                    "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name='schedules'",
+                    (old_seq[0],))
+                if cur.rowcount == 0:
+                    con.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) VALUES ('schedules', ?)",
+                        (old_seq[0],))
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+def _bootstrap():
+    """Migrate and create the schema over one short-lived connection"""
+    con = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        _migrate_feed_time(con)
+        new_indexes = not con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_sched_lookup'"
+        ).fetchone()
+        con.executescript(DDL)
+        # Gather planner statistics once, when the indexes are first built
+        if new_indexes:
+            con.executescript("BEGIN IMMEDIATE; ANALYZE; COMMIT;")
+    finally:
+        con.close()
+
+_bootstrap()
+_init_pool()
+# Under a pre-forking server (gunicorn --preload) each worker opens its own
+os.register_at_fork(after_in_child=_init_pool)
+
+# ------------------ Snapshot index ------------------
+IMAGES_DIR = os.path.join(app.instance_path, 'images')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SNAPSHOT_MAX_AGE = 31536000
+# Plain file names only; a leading dot would allow "." and ".."
+_SAFE_NAME = re.compile(r'\A[A-Za-z0-9_-][A-Za-z0-9._-]{0,127}\Z')
+
+# Filenames kept in ascending (timestamp, name) order; _snapshot_cache
+# buckets them by camera id in the same order
+_snapshot_lock = threading.Lock()
+_all_snapshots = []
+_snapshot_cache = {}
+# IMAGES_DIR mtime the index was built from; None forces a rescan
+_snapshot_mtime = None
+# Directory changes within this window of a scan may share its mtime tick
+_SNAPSHOT_RACY_NS = 2 * 10**9
+# Listing ETag derived from the file names, so every worker agrees on it
+_snapshot_tag = None
+
+def _snapshot_cam(filename):
+    """Camera id prefix of a "<camera_id>_<timestamp>.jpg" filename"""
+    return filename.rsplit('_', 1)[0]
+
+def _snapshot_key(filename):
+    """Sort key ordering snapshots by capture time across all cameras"""
+    stamp = filename.rsplit('_', 1)[-1].split('.', 1)[0]
+    return (int(stamp) if stamp.isdigit() else 0, filename)
+
+def _snapshot_etag():
+    """ETag for the current index; call with _snapshot_lock held"""
+    global _snapshot_tag
+    if _snapshot_tag is None:
+        digest = zlib.crc32('\n'.join(_all_snapshots).encode())
+        _snapshot_tag = f"{len(_all_snapshots)}-{digest:08x}"
+    return _snapshot_tag
+
+def _refresh_snapshots():
+    """Rescan IMAGES_DIR when its mtime shows it changed since the last scan
+
+    Catches files written or removed by other worker processes or by hand.
+    """
+    global _snapshot_mtime, _snapshot_tag
+    try:
+        mtime = os.stat(IMAGES_DIR).st_mtime_ns
+    except FileNotFoundError:
+        # Removed from under us; list nothing until an upload recreates it
+        with _snapshot_lock:
+            _all_snapshots.clear()
+            _snapshot_cache.clear()
+            _snapshot_tag = None
+            _snapshot_mtime = None
+        return
+    with _snapshot_lock:
+        if mtime == _snapshot_mtime:
+            return
+        with os.scandir(IMAGES_DIR) as it:
+            names = sorted((e.name for e in it
+                            if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS)),
+                           key=_snapshot_key)
+        _all_snapshots[:] = names
+        _snapshot_tag = None
+        _snapshot_cache.clear()
+        for name in names:
+            _snapshot_cache.setdefault(_snapshot_cam(name), []).append(name)
+        # A change in the same mtime tick as this scan would go unnoticed,
+        # so keep rescanning until the directory has been quiet for a while
+        recent = time.time_ns() - mtime < _SNAPSHOT_RACY_NS
+        _snapshot_mtime = None if recent else mtime
+
+os.makedirs(IMAGES_DIR, exist_ok=True)
+_refresh_snapshots()
+
+# ------------------ Image writer ------------------
+IMAGE_WRITE_BATCH = 32
+
+_image_q = None
+
+def _write_file(path, buf):
+    """Write a whole buffer with raw os.write calls, no userspace buffering
+
+    The frame is written under a unique temporary name and renamed into
+    place, so other workers rescanning IMAGES_DIR never list a half-written
+    image and two workers saving the same filename never share a temp file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        try:
+            os.fchmod(fd, 0o644)
+            view = memoryview(buf)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def _image_writer():
+    """Write queued uploads to disk off the request threads"""
+    while True:
+        # Block for one upload, then drain whatever else arrived meanwhile
+        batch = [_image_q.get()]
+        while len(batch) < IMAGE_WRITE_BATCH:
+            try:
+                batch.append(_image_q.get_nowait())
+            except queue.Empty:
+                break
+        for buf, path in batch:
+            try:
+                _write_file(path, buf)
+                logger.info("Saved: %s, Size: %d bytes", os.path.basename(path), len(buf))
+            except Exception as e:
+                # Keep the writer alive so the exit-time join below can finish
+                logger.error("Error saving image %s: %s", path, e)
+            finally:
+                _image_q.task_done()
+
+def _start_image_writer():
+    global _image_q
+    _image_q = queue.Queue()
+    threading.Thread(target=_image_writer, name="image-writer", daemon=True).start()
+
+_start_image_writer()
+# Threads do not survive fork, so every worker starts its own writer
+os.register_at_fork(after_in_child=_start_image_writer)
+# Uploads are acknowledged before they hit disk, so drain the queue on shutdown
+atexit.register(lambda: _image_q.join())
+
+# ------------------ SQL statements ------------------
+# Kept as module-level constants so every call passes the same string and
+# hits sqlite3's per-connection prepared statement cache.
+SQL_ACTIVE_MODULE = """
+    SELECT EXISTS(
+        SELECT 1 FROM modules
+        WHERE module_id=? AND status='active'
+    )
+"""
+
+SQL_CHECK_SCHED = """
+    SELECT s.schedule_id, s.amount,
+           printf('%02d:%02d', s.feed_time / 60, s.feed_time % 60) AS feed_time
+    FROM schedules s
+    JOIN modules m ON m.module_id = s.module_id
+    WHERE s.module_id=? AND m.status='active'
+      AND s.status='pending' AND s.feed_time<=?
+    ORDER BY s.feed_time ASC
+    LIMIT 1
+"""
+
+SQL_GET_SCHED = """
+    SELECT schedule_id, module_id, status FROM schedules
+    WHERE schedule_id=?
+"""
+
+SQL_COMPLETE_SCHED = """
+    UPDATE schedules SET status='done'
+    WHERE schedule_id=? AND status='pending'
+"""
+
+SQL_INSERT_HIST = "INSERT INTO history (schedule_id) VALUES (?)"
+
+# Only records history when the preceding SQL_COMPLETE_SCHED changed a row
+SQL_INSERT_HIST_IF_COMPLETED = """
+    INSERT INTO history (schedule_id) SELECT ? WHERE changes() = 1
+"""
+
+SQL_MODULE_EXISTS = "SELECT module_id FROM modules WHERE module_id=?"
+
+SQL_UPDATE_WEIGHT = """
+    UPDATE modules
+    SET weight=?, status='active'
+    WHERE module_id=?
+"""
+
+SQL_ACTIVE_CAMERA = """
+    SELECT cam_id FROM camera
+    WHERE cam_id=? AND status='active'
+"""
+
+SQL_LIST_CAMERAS = "SELECT * FROM camera ORDER BY rowid LIMIT ? OFFSET ?"
+
+SQL_INSERT_CAMERA = "INSERT INTO camera (cam_id, status) VALUES (?, ?)"
+
+SQL_UPDATE_CAMERA = "UPDATE camera SET status = ? WHERE cam_id = ?"
+
+SQL_DELETE_CAMERA = "DELETE FROM camera WHERE cam_id = ?"
+
+SQL_LIST_MODULES = "SELECT * FROM modules ORDER BY rowid LIMIT ? OFFSET ?"
+
+SQL_INSERT_MODULE = """
+    INSERT INTO modules (module_id, cam_id, status, weight)
+    VALUES (?, ?, ?, ?)
+"""
+
+SQL_UPDATE_MODULE = """
+    UPDATE modules
+    SET cam_id = ?, status = ?, weight = ?
+    WHERE module_id = ?
+"""
+
+SQL_DELETE_MODULE = "DELETE FROM modules WHERE module_id = ?"
+
+SQL_LIST_SCHEDULES = """
+    SELECT schedule_id, module_id,
+           printf('%02d:%02d', feed_time / 60, feed_time % 60) AS feed_time,
+           amount, status
+    FROM schedules
+    ORDER BY schedule_id
+    LIMIT ? OFFSET ?
+"""
+
+SQL_INSERT_SCHEDULE = """
+    INSERT INTO schedules (module_id, feed_time, amount, status)
+    VALUES (?, ?, ?, ?)
+"""
+
+SQL_UPDATE_SCHEDULE = """
+    UPDATE schedules
+    SET module_id = ?, feed_time = ?, amount = ?, status = ?
+    WHERE schedule_id = ?
+"""
+
+SQL_DELETE_SCHEDULE = "DELETE FROM schedules WHERE schedule_id = ?"
+
+SQL_LIST_HISTORY = """
+    SELECT history_id, created_at, schedule_id, module_id,
+           CASE WHEN feed_time IS NOT NULL
+                THEN printf('%02d:%02d', feed_time / 60, feed_time % 60)
+           END AS feed_time,
+           amount, status
+    FROM history_denorm
+    ORDER BY created_at DESC, history_id DESC
+    LIMIT ? OFFSET ?
+"""
+
+# Keyset variant for ?before=<history_id>, which avoids scanning skipped rows;
+# continues strictly after that row in the same order as SQL_LIST_HISTORY
+SQL_LIST_HISTORY_BEFORE = """
+    SELECT history_id, created_at, schedule_id, module_id,
+           CASE WHEN feed_time IS NOT NULL
+                THEN printf('%02d:%02d', feed_time / 60, feed_time % 60)
+           END AS feed_time,
+           amount, status
+    FROM history_denorm
+    WHERE (created_at, history_id) < (?, ?)
+    ORDER BY created_at DESC, history_id DESC
+    LIMIT ?
+"""
+
+SQL_HISTORY_CURSOR = "SELECT created_at FROM history_denorm WHERE history_id = ?"
+
+# Fallback when the cursor row has since been deleted: ids are assigned in
+# insertion order, so everything older than the cursor has a smaller id
+SQL_LIST_HISTORY_BELOW_ID = """
+    SELECT history_id, created_at, schedule_id, module_id,
+           CASE WHEN feed_time IS NOT NULL
+                THEN printf('%02d:%02d', feed_time / 60, feed_time % 60)
+           END AS feed_time,
+           amount, status
+    FROM history_denorm
+    WHERE history_id < ?
+    ORDER BY created_at DESC, history_id DESC
+    LIMIT ?
+"""
+
+SQL_DELETE_HISTORY = "DELETE FROM history WHERE history_id = ?"
 
 # ------------------ ESP32/DEVICE ROUTES ------------------
 @app.route("/health")
@@ -79,83 +580,75 @@ def health_check():
     """mDNS/health check endpoint for devices"""
     return "mDNS OK"
 
+def _now_minutes():
+    """Current local time as minutes since midnight, matching feed_time"""
+    t = time.localtime()
+    return t.tm_hour * 60 + t.tm_min
+
 @app.route("/check_schedule", methods=["POST"])
 def check_schedule():
     """Check if a module should dispense food now"""
     module_id = request.form.get("module_id")
     
     if not module_id:
-        return jsonify({"error": "Missing module_id"}), 400
-    
-    # Verify module exists and is active
-    module = query_db("""
-        SELECT module_id FROM modules
-        WHERE module_id=? AND status='active'
-    """, (module_id,), one=True)
-    
-    if not module:
-        return jsonify({"error": "Invalid or inactive module_id"}), 404
+        return ojson({"error": "Missing module_id"}, 400)
     
-    # Get current time in HH:MM format
-    now = datetime.now().strftime("%H:%M")
+    now = _now_minutes()
     
-    # Check for pending schedules at or before current time
-    row = query_db("""
-        SELECT schedule_id, amount, feed_time FROM schedules
-        WHERE module_id=? AND feed_time<=? AND status='pending'
-        ORDER BY feed_time ASC
-        LIMIT 1
-    """, (module_id, now), one=True)
+    # Check for pending schedules at or before current time on an active module
+    row = query_db(SQL_CHECK_SCHED, (module_id, now), one=True)
     
     if row:
-        return jsonify({
+        return ojson({
             "dispense": True, 
             "amount": row['amount'],
             "schedule_id": row['schedule_id'],
             "scheduled_time": row['feed_time']
         })
-    else:
-        return jsonify({"dispense": False})
+    
+    # Only look up the module when nothing is due, to tell the two cases apart
+    if not query_db(SQL_ACTIVE_MODULE, (module_id,), one=True)[0]:
+        return ojson({"error": "Invalid or inactive module_id"}, 404)
+    
+    return ojson({"dispense": False})
     
 @app.route("/complete_schedule", methods=["POST"])
 def complete_schedule():
     """Mark a schedule as done and add to history"""
-    schedule_id = request.form.get("schedule_id")
-    module_id = request.form.get("module_id")  # For verification
+    form = request.form
+    schedule_id = form.get("schedule_id")
+    module_id = form.get("module_id")  # For verification
     
     if not schedule_id:
-        return jsonify({"error": "Missing schedule_id"}), 400
+        return ojson({"error": "Missing schedule_id"}, 400)
     
     # Verify schedule exists and is still pending
-    schedule = query_db("""
-        SELECT schedule_id, module_id, status FROM schedules
-        WHERE schedule_id=?
-    """, (schedule_id,), one=True)
+    schedule = query_db(SQL_GET_SCHED, (schedule_id,), one=True)
     
     if not schedule:
-        return jsonify({"error": "Schedule not found"}), 404
+        return ojson({"error": "Schedule not found"}, 404)
     
     if schedule['status'] == 'done':
-        return jsonify({"error": "Schedule already completed"}), 400
+        return ojson({"error": "Schedule already completed"}, 400)
     
     # Optional: Verify module_id matches (security check)
     if module_id and schedule['module_id'] != module_id:
-        return jsonify({"error": "Module ID mismatch"}), 403
+        return ojson({"error": "Module ID mismatch"}, 403)
     
-    # Mark schedule as done
-    query_db("""
-        UPDATE schedules SET status='done' 
-        WHERE schedule_id=?
-    """, (schedule_id,))
+    # Mark schedule as done and add to history in a single commit; the
+    # pending guard is re-checked under the write lock so a concurrent
+    # completion of the same schedule cannot record it twice
+    updated, _ = query_db_tx([
+        (SQL_COMPLETE_SCHED, (schedule_id,)),
+        (SQL_INSERT_HIST_IF_COMPLETED, (schedule_id,)),
+    ])
     
-    # Add to history
-    query_db("""
-        INSERT INTO history (schedule_id) VALUES (?)
-    """, (schedule_id,))
+    if not updated:
+        return ojson({"error": "Schedule already completed"}, 400)
     
-    print(f"Schedule {schedule_id} completed by module {schedule['module_id']}")
+    logger.info("Schedule %s completed by module %s", schedule_id, schedule['module_id'])
     
-    return jsonify({
+    return ojson({
         "success": True,
         "message": "Schedule completed successfully",
         "schedule_id": schedule_id
@@ -164,41 +657,36 @@ def complete_schedule():
 @app.route("/weight_update", methods=["POST"])
 def weight_update():
     """Update module weight from ESP32"""
-    module_id = request.form.get("module_id")
-    weight = request.form.get("weight")
+    form = request.form
+    module_id = form.get("module_id")
+    weight = form.get("weight")
     
     if not module_id or weight is None:
-        return jsonify({"error": "Missing module_id or weight"}), 400
+        return ojson({"error": "Missing module_id or weight"}, 400)
     
     # Validate weight value
     try:
         weight_value = float(weight)
         if weight_value < 0 or weight_value > 10000:  # Max 10kg
-            return jsonify({"error": "Invalid weight value"}), 400
+            return ojson({"error": "Invalid weight value"}, 400)
     except ValueError:
-        return jsonify({"error": "Weight must be a number"}), 400
+        return ojson({"error": "Weight must be a number"}, 400)
     
-    print(f"Weight update - Device: {module_id}, Weight: {weight_value}g")
+    logger.info("Weight update - Device: %s, Weight: %sg", module_id, weight_value)
     
     # Check if module exists
-    existing = query_db("""
-        SELECT module_id FROM modules WHERE module_id=?
-    """, (module_id,), one=True)
+    existing = query_db(SQL_MODULE_EXISTS, (module_id,), one=True)
     
     if existing:
         # Update existing module with timestamp
-        query_db("""
-            UPDATE modules 
-            SET weight=?, status='active'
-            WHERE module_id=?
-        """, (weight_value, module_id))
+        query_db(SQL_UPDATE_WEIGHT, (weight_value, module_id), write=True)
     else:
         # Reject new modules (require manual registration for security)
-        return jsonify({
+        return ojson({
             "error": "Module not registered. Please register module first."
-        }), 403
+        }, 403)
     
-    return jsonify({
+    return ojson({
         "success": True,
         "message": f"Weight updated for {module_id}: {weight_value}g"
     })
@@ -206,25 +694,22 @@ def weight_update():
 # API: Delete specific snapshot
 @app.route('/api/snapshots/<filename>', methods=['DELETE'])
 def delete_snapshot(filename):
-    image_dir = 'instance/images'
     try:
-        filepath = os.path.join(image_dir, filename)
-       
-        # Check if file exists
-        if not os.path.exists(filepath):
-            return jsonify({'success': False, 'error': 'File not found'}), 404
-       
-        # Security check: ensure filename doesn't contain path traversal
-        if '..' in filename or '/' in filename or '\\' in filename:
+        # Security check: ensure filename can't escape the images directory
+        if not _SAFE_NAME.match(filename):
             return jsonify({'success': False, 'error': 'Invalid filename'}), 400
        
-        # Delete the file
-        os.remove(filepath)
-        print(f"Deleted image: {filename}")
+        # Delete the file; a missing file surfaces here instead of a separate stat
+        filepath = os.path.join(IMAGES_DIR, filename)
+        try:
+            os.unlink(filepath)
+        except FileNotFoundError:
+            return jsonify({'success': False, 'error': 'File not found'}), 404
+        logger.info("Deleted image: %s", filename)
        
         return jsonify({'success': True, 'message': f'Image {filename} deleted successfully'})
     except Exception as e:
-        print(f"Error deleting image {filename}: {str(e)}")
+        logger.error("Error deleting image %s: %s", filename, e)
         return jsonify({'success': False, 'error': str(e)}), 500
         
 @app.route("/upload_image", methods=["POST"])
@@ -236,10 +721,7 @@ def upload_image():
         return jsonify({"error": "Missing camera_id"}), 400
     
     # Verify camera exists and is active
-    camera = query_db("""
-        SELECT cam_id FROM camera
-        WHERE cam_id=? AND status='active'
-    """, (camera_id,), one=True)
+    camera = query_db(SQL_ACTIVE_CAMERA, (camera_id,), one=True)
     
     if not camera:
         return jsonify({"error": "Invalid or inactive camera_id"}), 404
@@ -250,18 +732,17 @@ def upload_image():
         return jsonify({"error": "No image data"}), 400
     
     # Create images directory if it doesn't exist
-    images_dir = os.path.join(app.instance_path, 'images')
-    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(IMAGES_DIR, exist_ok=True)
     
     # Save with camera_id and timestamp in filename
     timestamp = int(time.time())
     filename = f"{camera_id}_{timestamp}.jpg"
-    filepath = os.path.join(images_dir, filename)
-    
-    image.save(filepath)
-    file_size = os.path.getsize(filepath)
+    filepath = os.path.join(IMAGES_DIR, filename)
     
-    print(f"Saved: {filename}, Size: {file_size} bytes, Camera: {camera_id}")
+    # Hand the bytes to the background writer and reply immediately
+    data = image.read()
+    file_size = len(data)
+    _image_q.put((data, filepath))
     
     return jsonify({
         "success": True,
@@ -273,26 +754,26 @@ def upload_image():
 # ------------------ CAMERA ROUTES ------------------
 @app.route("/cameras", methods=["GET"])
 def get_cameras():
-    rows = query_db("SELECT * FROM camera")
-    return jsonify([dict(row) for row in rows])
+    cols, rows = query_db_rows(SQL_LIST_CAMERAS, page_args())
+    return ojson([dict(zip(cols, row)) for row in rows])
 
 @app.route("/cameras", methods=["POST"])
 def add_camera():
     data = request.get_json()
-    query_db("INSERT INTO camera (cam_id, status) VALUES (?, ?)",
-             (data["cam_id"], data["status"]))
+    query_db(SQL_INSERT_CAMERA,
+             (data["cam_id"], data["status"]), write=True)
     return jsonify({"success": True})
 
 @app.route("/cameras/<cam_id>", methods=["PUT"])
 def update_camera(cam_id):
     data = request.get_json()
-    query_db("UPDATE camera SET status = ? WHERE cam_id = ?",
-             (data["status"], cam_id))
+    query_db(SQL_UPDATE_CAMERA,
+             (data["status"], cam_id), write=True)
     return jsonify({"success": True})
 
 @app.route("/cameras/<cam_id>", methods=["DELETE"])
 def delete_camera(cam_id):
-    query_db("DELETE FROM camera WHERE cam_id = ?", (cam_id,))
+    query_db(SQL_DELETE_CAMERA, (cam_id,), write=True)
     return jsonify({"success": True})
 
 # ------------------ CAMERA ROUTES FOR WEBVIEW ------------------
@@ -300,132 +781,162 @@ def delete_camera(cam_id):
 # API: Get list of all captured images
 @app.route('/api/snapshots', methods=['GET'])
 def get_snapshots():
-    image_dir = 'instance/images'
     try:
-        # Check if directory exists
-        if not os.path.exists(image_dir):
-            os.makedirs(image_dir)
-            return jsonify({'success': True, 'images': []})
-        
-        # Get all image files
-        images = [f for f in os.listdir(image_dir) 
-                  if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        
-        # Sort by filename (newest first based on timestamp in name)
-        images.sort(reverse=True)
+        # Served from the in-memory index, newest timestamps first
+        _refresh_snapshots()
+        with _snapshot_lock:
+            etag = _snapshot_etag()
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+                resp.set_etag(etag, weak=True)
+                return resp
+            images = _page_newest_first(_all_snapshots)
         
-        return jsonify({'success': True, 'images': images})
+        resp = jsonify({'success': True, 'images': images})
+        resp.set_etag(etag, weak=True)
+        return resp
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def _page_newest_first(names):
+    """Slice one page off an ascending list, returned newest first
+
+    Unbounded unless ?limit= is given: the camera page loads the whole
+    gallery in one request and pairs frames by time on the client.
+    """
+    limit, offset = page_args(default_limit=None)
+    end = max(len(names) - offset, 0)
+    start = 0 if limit is None else max(end - limit, 0)
+    return names[start:end][::-1]
+
 # Serve individual snapshot image
 @app.route('/snapshots/<filename>')
 def serve_snapshot(filename):
     try:
-        return send_from_directory('instance/images', filename)
+        # Snapshot names embed their timestamp, so the content never changes
+        resp = send_from_directory(IMAGES_DIR, filename, conditional=True,
+                                   max_age=SNAPSHOT_MAX_AGE)
+        resp.headers['Cache-Control'] = f'public, max-age={SNAPSHOT_MAX_AGE}, immutable'
+        return resp
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 404
 
 # API: Get snapshots for specific camera
 @app.route('/api/snapshots/<cam_id>', methods=['GET'])
 def get_camera_snapshots(cam_id):
-    image_dir = 'instance/images'
     try:
-        if not os.path.exists(image_dir):
-            return jsonify({'success': True, 'images': []})
-        
-        # Filter images by camera ID
-        all_images = os.listdir(image_dir)
-        camera_images = [f for f in all_images 
-                        if f.startswith(f'CAMERA{cam_id}') or f.startswith(f'Camera{cam_id}')]
+        # Look up the pre-indexed buckets for this camera ID
+        _refresh_snapshots()
+        with _snapshot_lock:
+            etag = _snapshot_etag()
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+                resp.set_etag(etag, weak=True)
+                return resp
+            camera_images = sorted(_snapshot_cache.get(f'CAMERA{cam_id}', [])
+                                   + _snapshot_cache.get(f'Camera{cam_id}', []),
+                                   key=_snapshot_key)
         
-        camera_images.sort(reverse=True)
+        camera_images = _page_newest_first(camera_images)
         
-        return jsonify({'success': True, 'cam_id': cam_id, 'images': camera_images})
+        resp = jsonify({'success': True, 'cam_id': cam_id, 'images': camera_images})
+        resp.set_etag(etag, weak=True)
+        return resp
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
 # ------------------ MODULE ROUTES ------------------
 @app.route("/modules", methods=["GET"])
 def get_modules():
-    rows = query_db("SELECT * FROM modules")
-    return jsonify([dict(row) for row in rows])
+    cols, rows = query_db_rows(SQL_LIST_MODULES, page_args())
+    return ojson([dict(zip(cols, row)) for row in rows])
 
 @app.route("/modules", methods=["POST"])
 def add_module():
     data = request.get_json()
-    query_db("""
-        INSERT INTO modules (module_id, cam_id, status, weight)
-        VALUES (?, ?, ?, ?)
-    """, (data["module_id"], data["cam_id"], data["status"], data["weight"]))
+    query_db(SQL_INSERT_MODULE,
+             (data["module_id"], data["cam_id"], data["status"], data["weight"]), write=True)
     return jsonify({"success": True})
 
 @app.route("/modules/<module_id>", methods=["PUT"])
 def update_module(module_id):
     data = request.get_json()
-    query_db("""
-        UPDATE modules
-        SET cam_id = ?, status = ?, weight = ?
-        WHERE module_id = ?
-    """, (data["cam_id"], data["status"], data["weight"], module_id))
+    query_db(SQL_UPDATE_MODULE,
+             (data["cam_id"], data["status"], data["weight"], module_id), write=True)
     return jsonify({"success": True})
 
 @app.route("/modules/<module_id>", methods=["DELETE"])
 def delete_module(module_id):
-    query_db("DELETE FROM modules WHERE module_id = ?", (module_id,))
+    query_db(SQL_DELETE_MODULE, (module_id,), write=True)
     return jsonify({"success": True})
 
 # ------------------ SCHEDULE ROUTES ------------------
+def parse_feed_time(value):
+    """Convert "HH:MM" to minutes since midnight"""
+    h, m = str(value).split(':')
+    minutes = int(h) * 60 + int(m)
+    if not (0 <= int(m) < 60 and 0 <= minutes < 1440):
+        raise ValueError(f"Invalid feed time: {value}")
+    return minutes
+
 @app.route("/schedules", methods=["GET"])
 def get_schedules():
-    rows = query_db("SELECT * FROM schedules")
-    return jsonify([dict(row) for row in rows])
+    cols, rows = query_db_rows(SQL_LIST_SCHEDULES, page_args())
+    return ojson([dict(zip(cols, row)) for row in rows])
 
 @app.route("/schedules", methods=["POST"])
 def add_schedule():
     data = request.get_json()
-    query_db("""
-        INSERT INTO schedules (module_id, feed_time, amount, status)
-        VALUES (?, ?, ?, ?)
-    """, (data["module_id"], data["feed_time"], data["amount"], data.get("status", "pending")))
+    try:
+        feed_time = parse_feed_time(data["feed_time"])
+    except ValueError:
+        return jsonify({"error": "feed_time must be HH:MM"}), 400
+    query_db(SQL_INSERT_SCHEDULE,
+             (data["module_id"], feed_time, data["amount"], data.get("status", "pending")), write=True)
     return jsonify({"success": True})
 
 @app.route("/schedules/<int:schedule_id>", methods=["PUT"])
 def update_schedule(schedule_id):
     data = request.get_json()
-    query_db("""
-        UPDATE schedules
-        SET module_id = ?, feed_time = ?, amount = ?, status = ?
-        WHERE schedule_id = ?
-    """, (data["module_id"], data["feed_time"], data["amount"], data["status"], schedule_id))
+    try:
+        feed_time = parse_feed_time(data["feed_time"])
+    except ValueError:
+        return jsonify({"error": "feed_time must be HH:MM"}), 400
+    query_db(SQL_UPDATE_SCHEDULE,
+             (data["module_id"], feed_time, data["amount"], data["status"], schedule_id), write=True)
     return jsonify({"success": True})
 
 @app.route("/schedules/<int:schedule_id>", methods=["DELETE"])
 def delete_schedule(schedule_id):
-    query_db("DELETE FROM schedules WHERE schedule_id = ?", (schedule_id,))
+    query_db(SQL_DELETE_SCHEDULE, (schedule_id,), write=True)
     return jsonify({"success": True})
 
 # ------------------ HISTORY ROUTES ------------------
 @app.route("/history", methods=["GET"])
 def get_history():
-    rows = query_db("""
-        SELECT h.history_id, h.created_at, s.schedule_id, s.module_id, s.feed_time, s.amount, s.status
-        FROM history h
-        LEFT JOIN schedules s ON h.schedule_id = s.schedule_id
-        ORDER BY h.created_at DESC
-    """)
-    return jsonify([dict(row) for row in rows])
+    limit, offset = page_args()
+    before = request.args.get('before', type=int)
+    if before is not None:
+        cursor = query_db(SQL_HISTORY_CURSOR, (before,), one=True)
+        if cursor:
+            cols, rows = query_db_rows(SQL_LIST_HISTORY_BEFORE,
+                                       (cursor['created_at'], before, limit))
+        else:
+            cols, rows = query_db_rows(SQL_LIST_HISTORY_BELOW_ID, (before, limit))
+    else:
+        cols, rows = query_db_rows(SQL_LIST_HISTORY, (limit, offset))
+    return ojson([dict(zip(cols, row)) for row in rows])
 
 @app.route("/history", methods=["POST"])
 def add_history():
     data = request.get_json()
-    query_db("INSERT INTO history (schedule_id) VALUES (?)",
-             (data["schedule_id"],))
+    query_db(SQL_INSERT_HIST,
+             (data["schedule_id"],), write=True)
     return jsonify({"success": True})
 
 @app.route("/history/<int:history_id>", methods=["DELETE"])
 def delete_history(history_id):
-    query_db("DELETE FROM history WHERE history_id = ?", (history_id,))
+    query_db(SQL_DELETE_HISTORY, (history_id,), write=True)
     return jsonify({"success": True})
 
 # ------------------ FRONTEND ROUTES ------------------
@@ -454,5 +965,6 @@ def serve_camera():
     return render_template("camera.html")
 
 # ------------------ Run App ------------------
+# Development server only; production runs under gunicorn (see Procfile)
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080, debug=True, threaded=True)